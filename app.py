@@ -59,7 +59,54 @@ with st.sidebar:
     voice_label = st.selectbox("ナレーター音声", list(voice_map.keys()), index=0)
     selected_voice = voice_map[voice_label]
     
+    # Multi-voice export (video is encoded once, narrations are muxed in)
+    multi_voice = st.checkbox("複数ナレーターで書き出す", value=False)
+    if multi_voice:
+        export_voice_labels = st.multiselect("書き出すナレーター", list(voice_map.keys()), default=list(voice_map.keys()))
+        # The narrator selected above becomes the default audio track
+        export_voices = [selected_voice] + [voice_map[label] for label in export_voice_labels if voice_map[label] != selected_voice]
+        voice_mode_map = {
+            "1つのMP4に複数音声トラック": "tracks",
+            "ナレーターごとに別ファイル": "files"
+        }
+        voice_mode = voice_mode_map[st.radio("音声の格納方法", list(voice_mode_map.keys()), index=0)]
+    else:
+        export_voices = [selected_voice]
+        voice_mode = "tracks"
+    
     tone_option = st.selectbox("トーン＆マナー", ["フォーマル (Formal)", "カジュアル (Casual)", "エネルギッシュ (Energetic)"], index=0)
+    
+    # Output Formats (all variants are rendered in one job)
+    profile_map = {
+        "横長 16:9 (YouTube/講義)": "16:9",
+        "縦長 9:16 (ショート/リール)": "9:16",
+        "正方形 1:1 (SNS)": "1:1"
+    }
+    profile_labels = st.multiselect("出力フォーマット", list(profile_map.keys()), default=list(profile_map.keys())[:1])
+    output_profiles = [profile_map[label] for label in profile_labels] or ["16:9"]
+    
+    # Slide Theme (layout + colours)
+    theme_map = {
+        "スレート (左テキスト・右写真)": "slate",
+        "ペーパー (明るい配色)": "paper",
+        "ミッドナイト (全面写真)": "midnight",
+        "シネマ (タイトルのみ)": "cinema"
+    }
+    theme_label = st.selectbox("スライドテーマ", list(theme_map.keys()), index=0)
+    selected_theme = theme_map[theme_label]
+    
+    # Slide Transition
+    transition_map = {
+        "フェードイン (黒から)": "fade",
+        "クロスフェード": "crossfade",
+        "スライド (ワイプ)": "wipe",
+        "なし": "none"
+    }
+    transition_label = st.selectbox("トランジション", list(transition_map.keys()), index=0)
+    selected_transition = transition_map[transition_label]
+    
+    # Slides are handed to the encoder in memory; PNGs are only written on request
+    save_slide_png = st.checkbox("スライド画像(PNG)も保存する", value=False)
 
 # --- Main Area ---
 st.title("🎬 E&Endeavor Slide Studio")
@@ -180,44 +227,64 @@ if 'plan' in st.session_state:
     # Check if we already have generated slides
     if 'generated_slides' not in st.session_state:
         st.session_state['generated_slides'] = {}
+    if 'generated_variants' not in st.session_state:
+        st.session_state['generated_variants'] = {}
+    if 'generated_themes' not in st.session_state:
+        st.session_state['generated_themes'] = {}
+    if 'backgrounds' not in st.session_state:
+        st.session_state['backgrounds'] = {}
         
     if st.button("スライドを一括作成する (Pexels + Pillow)", type="primary"):
         # Import helper modules here to avoid top-level errors if files are missing
         try:
             from image_gen import generate_background_image
-            from slide_renderer import draw_slide
+            from image_library import RECENT_WINDOW
+            from collections import deque
+            from slide_renderer import draw_slide_variants
             
             progress_bar = st.progress(0)
             status_text = st.empty()
             
             total_slides = len(plan.get('slides', []))
             
+            # Images used by the previous slides of this run (kept per job, not per process)
+            recent_images = deque(maxlen=RECENT_WINDOW)
+            
             for index, slide in enumerate(plan.get('slides', [])):
                 slide_num = slide['slide_number']
                 
-                # Check if already generated to avoid re-cost
-                if slide_num in st.session_state['generated_slides']:
+                # Check if already generated (for every selected format and theme) to avoid re-cost
+                existing = st.session_state['generated_variants'].get(slide_num, {})
+                if (all(profile in existing for profile in output_profiles)
+                        and st.session_state['generated_themes'].get(slide_num) == selected_theme):
                     continue
                 
                 status_text.text(f"スライド {slide_num}/{total_slides} を生成中... (背景画像生成)")
                 
-                # 1. Generate Background
+                # 1. Generate Background (reused when only the theme/format changed)
                 try:
-                    # Retry logic already handled inside image_gen or here if needed
-                    # We rely on image_gen.py returning a PIL Image or fallback
-                    bg_image = generate_background_image(slide['image_prompt_en'])
+                    bg_image = st.session_state['backgrounds'].get(slide_num)
+                    if bg_image is None:
+                        # Retry logic already handled inside image_gen or here if needed
+                        # We rely on image_gen.py returning a PIL Image or fallback
+                        bg_image = generate_background_image(slide['image_prompt_en'], recent=recent_images)
+                        st.session_state['backgrounds'][slide_num] = bg_image
                     
                     status_text.text(f"スライド {slide_num}/{total_slides} を合成中... (文字入れ)")
                     
-                    # 2. Text Overlay
-                    final_slide = draw_slide(
+                    # 2. Text Overlay (all formats from the same decoded background)
+                    variants = draw_slide_variants(
                         background_image=bg_image,
                         title=slide['title'],
-                        bullet_points=slide['bullet_points']
+                        bullet_points=slide['bullet_points'],
+                        profiles=output_profiles,
+                        theme=selected_theme
                     )
                     
-                    # Store in session state
-                    st.session_state['generated_slides'][slide_num] = final_slide
+                    # Store in session state (first format is used for the preview)
+                    st.session_state['generated_variants'][slide_num] = variants
+                    st.session_state['generated_themes'][slide_num] = selected_theme
+                    st.session_state['generated_slides'][slide_num] = variants[output_profiles[0]]
                     
                 except Exception as e:
                     st.error(f"スライド {slide_num} の生成中にエラー: {e}")
@@ -255,77 +322,209 @@ if 'plan' in st.session_state:
         st.divider()
         st.header("🎥 Phase 3: 動画書き出し (MP4)")
         
+        # Cost prediction (before any narration is synthesized)
+        from render_cost import estimate_job
+        scripts = [slide['script'] for slide in plan.get('slides', [])]
+        predicted = estimate_job(scripts, export_voices, output_profiles, transition=selected_transition)
+        st.caption(
+            f"推定動画長: 約{predicted['duration'] / 60:.1f}分 / "
+            f"推定レンダリング時間: 約{predicted['encode_seconds'] / 60:.1f}分 / "
+            f"推定メモリ: 約{predicted['peak_memory_mb']:.0f}MB"
+        )
+        
         if st.button("動画を生成・ダウンロードする (Python/MoviePy)", type="primary"):
             try:
-                from audio_gen import generate_audio
-                from video_gen import create_video
+                from audio_gen import generate_audio_batch, get_audio_duration
+                from video_gen import create_video_variants, create_multi_voice_videos
+                from render_cost import (
+                    AdmissionRejected, encode_work, get_admission_controller,
+                    record_encode, record_narrations
+                )
                 import shutil
+                import tempfile
+                import time
                 
-                # Setup Temp Directory
-                temp_dir = "temp_assets"
-                if os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
-                os.makedirs(temp_dir)
-                
-                progress_bar_video = st.progress(0)
-                status_text_video = st.empty()
-                
-                slides_data = []
                 slides = plan.get('slides', [])
                 total = len(slides)
                 
-                for i, slide in enumerate(slides):
-                    slide_num = slide['slide_number']
-                    status_text_video.text(f"スライド {slide_num}/{total} の素材を準備中... (音声合成)")
+                # Formats added or a theme changed after Phase 2: the rendered slides
+                # no longer match the settings, so never drop or mix them silently
+                outdated = [
+                    slide['slide_number'] for slide in slides
+                    if slide['slide_number'] in st.session_state['generated_variants']
+                    and (
+                        not all(profile in st.session_state['generated_variants'][slide['slide_number']] for profile in output_profiles)
+                        or st.session_state['generated_themes'].get(slide['slide_number']) != selected_theme
+                    )
+                ]
+                if outdated:
+                    st.error(
+                        f"出力フォーマットまたはテーマが変更されています (スライド {', '.join(map(str, outdated))})。"
+                        "Phase 2 の「スライドを一括作成する」を再実行してから動画を生成してください。"
+                    )
+                    st.stop()
+                
+                # Setup Temp Directory (one per job: jobs admitted side by side must not share files)
+                temp_dir = tempfile.mkdtemp(prefix="temp_assets_")
+                try:
+                    png_dir = os.path.join(temp_dir, "slides")
+                    if save_slide_png:
+                        os.makedirs(png_dir)
+                    
+                    progress_bar_video = st.progress(0)
+                    status_text_video = st.empty()
                     
-                    if slide_num not in st.session_state['generated_slides']:
-                        continue
+                    slides_data = []
+                    audio_jobs = []
+                    
+                    for i, slide in enumerate(slides):
+                        slide_num = slide['slide_number']
+                        status_text_video.text(f"スライド {slide_num}/{total} の素材を準備中...")
+                        
+                        # Slides that failed in Phase 2 are skipped (as before)
+                        variants = st.session_state['generated_variants'].get(slide_num)
+                        if variants is None:
+                            continue
+                            
+                        # 1. Collect Frames (one per output format, passed in memory)
+                        frames = {profile: variants[profile] for profile in output_profiles}
+                        if save_slide_png:
+                            for profile, img in frames.items():
+                                img.save(os.path.join(png_dir, f"slide_{slide_num}_{profile.replace(':', 'x')}.png"))
                         
-                    # 1. Save Image
-                    img = st.session_state['generated_slides'][slide_num]
-                    img_path = os.path.join(temp_dir, f"slide_{slide_num}.png")
-                    img.save(img_path)
+                        # 2. Queue Audio (one narration per voice)
+                        audio_paths = {}
+                        for voice in export_voices:
+                            audio_path = os.path.join(temp_dir, f"slide_{slide_num}_{voice}.mp3")
+                            # Use formatted script
+                            audio_jobs.append((slide['script'], audio_path, voice))
+                            audio_paths[voice] = audio_path
+                            
+                        slides_data.append({
+                            "frames": frames,
+                            "audio_paths": audio_paths,
+                            "audio_path": audio_paths[selected_voice]
+                        })
+                        
+                        progress_bar_video.progress((i + 0.5) / total * 0.5)
+                    
+                    # Admission control: wait for (or refuse) capacity on this node before
+                    # any narration is synthesized. Peak memory and CPU do not depend on
+                    # the narration length, so the prediction above is enough.
+                    controller = get_admission_controller()
+                    if controller.queue_length() > 0 or controller.cpu_in_use > 0:
+                        status_text_video.text("他のジョブの完了を待っています...")
                     
-                    # 2. Generate Audio
-                    audio_path = os.path.join(temp_dir, f"slide_{slide_num}.mp3")
-                    # Use formatted script
-                    script = slide['script']
-                    if not generate_audio(script, audio_path, voice=selected_voice):
-                        st.error(f"音声生成に失敗しました: Slide {slide_num}")
+                    try:
+                        with controller.admit(predicted):
+                            # 3. Generate Audio (all slides and voices concurrently)
+                            status_text_video.text("音声を合成中...")
+                            for (_, audio_path, voice), ok in zip(audio_jobs, generate_audio_batch(audio_jobs)):
+                                if not ok:
+                                    st.error(f"音声生成に失敗しました: {os.path.basename(audio_path)} ({voice})")
+                                    st.stop()
+                            progress_bar_video.progress(0.5)
+                            
+                            # Calibrate the narration model with the real durations
+                            slide_durations = {}
+                            measurements = []
+                            for script, audio_path, voice in audio_jobs:
+                                duration = get_audio_duration(audio_path)
+                                if duration:
+                                    measurements.append((voice, script, duration))
+                                    slide_durations[audio_path] = duration
+                            record_narrations(measurements)
+                            durations = [
+                                max(slide_durations.get(path, 0.0) for path in slide_data['audio_paths'].values())
+                                for slide_data in slides_data
+                            ]
+                            
+                            status_text_video.text("動画をレンダリング中... (これには数分かかる場合があります)")
+                            encode_start = time.monotonic()
+                            
+                            # 4. Create Videos (all formats in one job)
+                            output_paths = {
+                                profile: os.path.join(temp_dir, f"final_presentation_{profile.replace(':', 'x')}.mp4")
+                                for profile in output_profiles
+                            }
+                            downloads = []  # (label, path, file name)
+                            if len(export_voices) > 1:
+                                results = create_multi_voice_videos(
+                                    slides_data, output_paths, export_voices,
+                                    mode=voice_mode, transition=selected_transition, work_dir=temp_dir
+                                )
+                                for profile, by_voice in results.items():
+                                    if voice_mode == "tracks":
+                                        if by_voice:
+                                            path = by_voice[export_voices[0]]
+                                            downloads.append((profile, path, os.path.basename(path)))
+                                    else:
+                                        for voice, path in by_voice.items():
+                                            downloads.append((f"{profile} / {voice}", path, os.path.basename(path)))
+                            else:
+                                results = create_video_variants(
+                                    slides_data, output_paths,
+                                    transition=selected_transition, work_dir=temp_dir
+                                )
+                                for profile, path in results.items():
+                                    if path:
+                                        downloads.append((profile, path, f"presentation_{profile.replace(':', 'x')}.mp4"))
+                            
+                            # Calibrate the encode model (variants run in parallel: largest one sets the pace)
+                            if downloads:
+                                record_encode(
+                                    "segments",
+                                    max(encode_work(profile, durations, transition=selected_transition) for profile in output_profiles),
+                                    time.monotonic() - encode_start
+                                )
+                    except AdmissionRejected as e:
+                        st.error(f"現在のサーバー負荷では動画を生成できません。スライド枚数や出力フォーマットを減らすか、しばらくしてから再度お試しください。({e})")
                         st.stop()
-                        
-                    slides_data.append({
-                        "image_path": img_path,
-                        "audio_path": audio_path
-                    })
                     
-                    progress_bar_video.progress((i + 0.5) / total)
-                
-                status_text_video.text("動画をレンダリング中... (これには数分かかる場合があります)")
-                
-                # 3. Create Video
-                output_video_path = "final_presentation.mp4"
-                result_path = create_video(slides_data, output_video_path)
-                
-                progress_bar_video.progress(1.0)
-                
-                if result_path and os.path.exists(result_path):
-                    status_text_video.text("動画完成！")
-                    st.success("動画の生成が完了しました！")
+                    progress_bar_video.progress(1.0)
                     
-                    # Display Video
-                    st.video(result_path)
+                    finished = [item for item in downloads if os.path.exists(item[1])]
                     
-                    # Download Button
-                    with open(result_path, "rb") as file:
-                        btn = st.download_button(
-                            label="MP4動画をダウンロード",
-                            data=file,
-                            file_name="presentation.mp4",
-                            mime="video/mp4"
-                        )
-                else:
-                    st.error("動画ファイルの生成に失敗しました。")
+                    if finished:
+                        status_text_video.text("動画完成！")
+                        st.success("動画の生成が完了しました！")
+                        if len(export_voices) > 1 and voice_mode == "tracks":
+                            st.caption("※ ブラウザのプレビューでは最初の音声トラックのみ再生されます。VLC等のプレイヤーで音声トラックを切り替えられます。")
+                        
+                        tabs = st.tabs([label for label, _, _ in finished])
+                        for tab, (label, result_path, file_name) in zip(tabs, finished):
+                            with tab:
+                                # Display Video
+                                st.video(result_path)
+                                
+                                # Download Button
+                                with open(result_path, "rb") as file:
+                                    btn = st.download_button(
+                                        label=f"MP4動画をダウンロード ({label})",
+                                        data=file,
+                                        file_name=file_name,
+                                        mime="video/mp4",
+                                        key=f"download_{label}"
+                                    )
+                        
+                        if len(finished) < len(output_profiles) * (len(export_voices) if voice_mode == "files" else 1):
+                            st.warning("一部の動画の生成に失敗しました。")
+                        
+                        if save_slide_png:
+                            archive_path = shutil.make_archive(os.path.join(temp_dir, "slide_images"), "zip", png_dir)
+                            with open(archive_path, "rb") as file:
+                                st.download_button(
+                                    label="スライド画像 (PNG/ZIP) をダウンロード",
+                                    data=file,
+                                    file_name="slides.zip",
+                                    mime="application/zip",
+                                    key="download_slide_png"
+                                )
+                    else:
+                        st.error("動画ファイルの生成に失敗しました。")
+                finally:
+                    # Videos and downloads are handed to Streamlit above; the job's files can go
+                    shutil.rmtree(temp_dir, ignore_errors=True)
                     
             except ImportError as e:
                 st.error(f"必要なライブラリが見つかりません: {e}")
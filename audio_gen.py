@@ -6,6 +6,43 @@ async def _generate_audio_async(text, output_path, voice):
     communicate = edge_tts.Communicate(text, voice)
     await communicate.save(output_path)
 
+# Upper bound on simultaneous Edge TTS connections in a batch
+MAX_CONCURRENT_TTS = 8
+
+async def _generate_audio_batch_async(jobs):
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TTS)
+
+    async def _limited(text, output_path, voice):
+        async with semaphore:
+            await _generate_audio_async(text, output_path, voice)
+
+    return await asyncio.gather(
+        *(_limited(text, output_path, voice) for text, output_path, voice in jobs),
+        return_exceptions=True
+    )
+
+def _run_async(coro):
+    """
+    Runs a coroutine to completion, even when called from inside
+    Streamlit's own event loop.
+    """
+    # Streamlit runs its own event loop, so asyncio.run() may fail.
+    # Use a new event loop in a thread-safe manner instead.
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    if loop and loop.is_running():
+        # We're inside an existing event loop (Streamlit Cloud)
+        # Create a new loop in a separate thread
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor() as pool:
+            return pool.submit(asyncio.run, coro).result()
+    else:
+        # No running loop, safe to use asyncio.run()
+        return asyncio.run(coro)
+
 def generate_audio(text, output_path, voice="ja-JP-NanamiNeural"):
     """
     Generates audio from text using Microsoft Edge TTS (high quality neural voices).
@@ -19,22 +56,7 @@ def generate_audio(text, output_path, voice="ja-JP-NanamiNeural"):
         bool: True if successful, False otherwise.
     """
     try:
-        # Streamlit runs its own event loop, so asyncio.run() may fail.
-        # Use a new event loop in a thread-safe manner instead.
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = None
-
-        if loop and loop.is_running():
-            # We're inside an existing event loop (Streamlit Cloud)
-            # Create a new loop in a separate thread
-            import concurrent.futures
-            with concurrent.futures.ThreadPoolExecutor() as pool:
-                pool.submit(asyncio.run, _generate_audio_async(text, output_path, voice)).result()
-        else:
-            # No running loop, safe to use asyncio.run()
-            asyncio.run(_generate_audio_async(text, output_path, voice))
+        _run_async(_generate_audio_async(text, output_path, voice))
         
         return os.path.exists(output_path)
     except Exception as e:
@@ -42,3 +64,43 @@ def generate_audio(text, output_path, voice="ja-JP-NanamiNeural"):
         import traceback
         traceback.print_exc()
         return False
+
+def generate_audio_batch(jobs):
+    """
+    Synthesizes several narrations concurrently (e.g. every slide for every voice).
+    
+    Args:
+        jobs (list): List of (text, output_path, voice) tuples
+        
+    Returns:
+        list: One bool per job, True if that file was generated.
+    """
+    try:
+        outcomes = _run_async(_generate_audio_batch_async(jobs))
+    except Exception as e:
+        print(f"Error generating audio batch: {e}")
+        import traceback
+        traceback.print_exc()
+        return [False] * len(jobs)
+    
+    results = []
+    for (text, output_path, voice), outcome in zip(jobs, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"Error generating audio ({voice}, {output_path}): {outcome}")
+        results.append(not isinstance(outcome, Exception) and os.path.exists(output_path))
+    return results
+
+def get_audio_duration(path):
+    """
+    Returns the duration of an audio file in seconds, or None if it cannot be read.
+    """
+    try:
+        from moviepy.editor import AudioFileClip
+        clip = AudioFileClip(path)
+        try:
+            return clip.duration
+        finally:
+            clip.close()
+    except Exception as e:
+        print(f"Error reading audio duration: {e}")
+        return None
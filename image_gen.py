@@ -5,12 +5,40 @@ import requests
 import urllib.parse
 import random
 
-def get_pexels_image(query):
+from image_library import get_library, tokenize
+
+# Pexels results requested per search; the first one not used for the
+# previous slides (see RECENT_WINDOW) is taken
+PEXELS_RESULTS = 5
+
+def _use(image, recent):
+    """
+    Marks a library image as used by this job so the next slides skip it.
     """
-    Fetches a high quality image from Pexels API based on query.
+    if recent is not None and "library_id" in image.info:
+        recent.append(image.info["library_id"])
+    return image
+
+def get_pexels_image(query, recent=None):
+    """
+    Fetches a high quality image for the query.
+    The local image library (image_library.py) is searched first; online results
+    from Pexels are ingested into it so the library grows over time.
     If no API Key is found, uses a high-quality "Mock" dictionary to simulate the API.
+    
+    Args:
+        query (str): search keywords
+        recent (deque): library ids used for the previous slides of this job
+                        (skipped by the lookup, updated with the returned image)
     """
     api_key = os.environ.get("PEXELS_API_KEY")
+    library = get_library()
+    
+    # --- LOCAL LIBRARY (no network) ---
+    cached = library.lookup(query, exclude=recent or ())
+    if cached is not None:
+        print(f"Library match found for: {query}")
+        return _use(cached, recent)
     
     # --- MOCK DATA FOR DEMO WITHOUT KEY ---
     # Top quality Pexels image URLs for common business/tech keywords
@@ -27,48 +55,75 @@ def get_pexels_image(query):
         "default": "https://images.pexels.com/photos/1181244/pexels-photo-1181244.jpeg" # Safe fallback
     }
 
+    used = set(recent or ())
+
     if not api_key:
         print("PEXELS_API_KEY not found. Using MOCK data for demo.")
-        # Simple keyword matching
-        query_lower = query.lower()
-        image_url = MOCK_IMAGES["default"]
-        
-        for key in MOCK_IMAGES:
-            if key in query_lower:
-                image_url = MOCK_IMAGES[key]
-                print(f"Mock match found for '{key}': {image_url}")
-                break
+        # Keyword matching on whole words ("ai" must not match "detail"),
+        # skipping photos used for the previous slides
+        query_tokens = set(tokenize(query))
+        candidates = [key for key in MOCK_IMAGES if key in query_tokens] + ["default"]
         
-        try:
-            img_response = requests.get(image_url, timeout=10)
-            if img_response.status_code == 200:
-                return Image.open(io.BytesIO(img_response.content))
-        except Exception as e:
-            print(f"Mock fetch failed: {e}")
-            return get_fallback_image(query)
+        for mock_key in candidates:
+            image_url = MOCK_IMAGES[mock_key]
+            if library.source_id(image_url) in used:
+                continue
+            print(f"Mock match found for '{mock_key}': {image_url}")
+            
+            # Index the photo only under its own mock keyword(s), never the whole
+            # query and never "default"
+            tags = " ".join(key for key, url in MOCK_IMAGES.items() if url == image_url and key != "default")
+            
+            # Already in the library: reuse the local copy
+            cached = library.get(image_url)
+            if cached is not None:
+                return _use(library.ingest(cached, tags, image_url), recent)
+            
+            try:
+                img_response = requests.get(image_url, timeout=10)
+                if img_response.status_code == 200:
+                    img = Image.open(io.BytesIO(img_response.content))
+                    return _use(library.ingest(img, tags, image_url), recent)
+            except Exception as e:
+                print(f"Mock fetch failed: {e}")
+            break
+        return get_fallback_image(query, recent)
         
     try:
         headers = {
             "Authorization": api_key
         }
-        # Search for 1 landscape photo, large size
+        # Search for a few landscape photos, so one not used by the previous slides can be picked
         encoded_query = urllib.parse.quote(query)
-        url = f"https://api.pexels.com/v1/search?query={encoded_query}&per_page=1&orientation=landscape"
+        url = f"https://api.pexels.com/v1/search?query={encoded_query}&per_page={PEXELS_RESULTS}&orientation=landscape"
         
         print(f"Searching Pexels for: {query}")
         response = requests.get(url, headers=headers, timeout=10)
         
         if response.status_code == 200:
             data = response.json()
-            if data['photos']:
-                # Get 'large' or 'original' image URL
-                image_url = data['photos'][0]['src']['large2x'] # good quality
+            # Get 'large2x' image URL (good quality) of the first photo not used recently
+            photo = next(
+                (p for p in data['photos'] if library.source_id(p['src']['large2x']) not in used),
+                None
+            )
+            if photo:
+                image_url = photo['src']['large2x']
+                caption = photo.get('alt') or ""
                 print(f"Found Pexels Image: {image_url}")
                 
+                # Already in the library: only merge the new keywords
+                cached = library.get(image_url)
+                if cached is not None:
+                    return _use(library.ingest(cached, query, image_url, caption=caption), recent)
+                
                 # Download image
                 img_response = requests.get(image_url, timeout=15)
                 if img_response.status_code == 200:
-                    return Image.open(io.BytesIO(img_response.content))
+                    img = Image.open(io.BytesIO(img_response.content))
+                    return _use(library.ingest(img, query, image_url, caption=caption), recent)
+            elif data['photos']:
+                print("All Pexels results were used for recent slides.")
             else:
                 print("No photos found on Pexels.")
         else:
@@ -78,11 +133,12 @@ def get_pexels_image(query):
         print(f"Pexels search failed: {e}")
 
     # Fallback if Pexels fails
-    return get_fallback_image(query)
+    return get_fallback_image(query, recent)
 
-def get_fallback_image(prompt):
+def get_fallback_image(prompt, recent=None):
     """
-    Tries Picsum as a guaranteed fallback.
+    Tries Picsum as a guaranteed fallback. Picsum photos are random, so they are
+    stored in the image library without keywords (never returned by a lookup).
     """
     try:
         # Use a random seed based on prompt to get consistent random results per slide
@@ -92,19 +148,21 @@ def get_fallback_image(prompt):
         
         response = requests.get(url, timeout=5)
         if response.status_code == 200:
-            return Image.open(io.BytesIO(response.content))
+            img = Image.open(io.BytesIO(response.content))
+            # The redirected URL identifies the actual photo (the seed URL does not)
+            return _use(get_library().ingest(img, "", response.url), recent)
     except Exception as e:
         print(f"Picsum fallback failed: {e}")
 
     # Absolute Last Resort
     return Image.new('RGB', (1920, 1080), color=(50, 50, 50))
 
-def generate_background_image(prompt_en):
+def generate_background_image(prompt_en, recent=None):
     """
     Main entry point. Now uses Pexels instead of Gemini.
     Arg name is kept as 'prompt_en' for compatibility, but treated as search keywords.
+    Pass the same `recent` deque for every slide of a job so consecutive slides differ.
     """
     # Simply redirect to Pexels search
-    # We might want to clean keywords slightly (remove 'high quality', 'cinematic', etc if Gemini adds them)
-    # But usually Pexels handles them fine.
-    return get_pexels_image(prompt_en)
+    # Gemini boilerplate ('high quality', 'cinematic', etc) is stripped by the library tokenizer.
+    return get_pexels_image(prompt_en, recent)
@@ -0,0 +1,190 @@
+import os
+import re
+import json
+import math
+import hashlib
+import threading
+from PIL import Image
+
+from slide_renderer import fit_image, PANEL_SIZES
+
+# Where the offline library lives. Can be pointed at a shared volume.
+LIBRARY_DIR = os.environ.get("IMAGE_LIBRARY_DIR", "image_library")
+
+# Masters are stored downscaled to this width (the full slide width)
+MASTER_MAX_WIDTH = 1920
+
+# How many recently returned images a job skips so consecutive slides differ
+# (callers keep their own deque(maxlen=RECENT_WINDOW) per job)
+RECENT_WINDOW = 3
+
+# Words that carry no meaning for search. Includes the boilerplate Gemini puts
+# in front of every image_prompt_en ("High quality, photorealistic, cinematic lighting").
+STOP_WORDS = {
+    "a", "an", "the", "and", "or", "of", "in", "on", "at", "to", "for", "with",
+    "by", "from", "as", "is", "are", "be", "into", "over", "under", "about",
+    "this", "that", "these", "those", "it", "its", "their", "showing", "shows",
+    "image", "photo", "picture", "background", "scene", "view", "shot",
+    "high", "quality", "photorealistic", "realistic", "cinematic", "lighting",
+    "light", "professional", "detailed", "ultra", "hd", "4k", "8k", "resolution",
+    "sharp", "focus", "style", "beautiful", "modern", "no", "text", "without",
+}
+
+
+def tokenize(text):
+    """
+    Splits free text (search query, Pexels alt text, Gemini prompt) into
+    lowercase keywords, dropping stop words and simple plural 's'.
+    """
+    tokens = []
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if word in STOP_WORDS or len(word) < 2:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class ImageLibrary:
+    """
+    Offline stock-image library backed by a directory of JPEGs and an
+    inverted keyword index (index.json). The index is loaded into memory
+    once, so lookups are plain dict operations.
+    """
+
+    def __init__(self, root=LIBRARY_DIR):
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+        self.images = {}     # image_id -> {"tags": [...], "source": url}
+        self.postings = {}   # keyword -> [image_id, ...]
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.images = data.get("images", {})
+            self.postings = data.get("postings", {})
+        except Exception as e:
+            print(f"Failed to load image library index: {e}")
+            self.images = {}
+            self.postings = {}
+
+    def _save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"images": self.images, "postings": self.postings}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def _master_path(self, image_id):
+        return os.path.join(self.root, f"{image_id}.jpg")
+
+    def _crop_path(self, image_id, size):
+        return os.path.join(self.root, f"{image_id}_{size[0]}x{size[1]}.jpg")
+
+    def get(self, source):
+        """
+        Returns the library copy of an image by its source URL, or None.
+        """
+        image_id = self.source_id(source)
+        with self._lock:
+            if image_id in self.images and os.path.exists(self._master_path(image_id)):
+                return self._open(image_id)
+            return None
+
+    @staticmethod
+    def source_id(source):
+        """
+        Library id of an image by its source URL (what `recent` deques hold).
+        """
+        return hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+
+    def lookup(self, query, exclude=()):
+        """
+        Returns the best matching PIL Image for the query, or None.
+        Candidates are ranked by the summed IDF of the matching keywords.
+        Image ids in `exclude` (the caller's recently used images) are skipped.
+        """
+        with self._lock:
+            scores = {}
+            total = max(len(self.images), 1)
+            for token in set(tokenize(query)):
+                ids = self.postings.get(token)
+                if not ids:
+                    continue
+                idf = math.log(1 + total / len(ids))
+                for image_id in ids:
+                    scores[image_id] = scores.get(image_id, 0.0) + idf
+
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+            for image_id, _ in ranked:
+                if image_id in exclude:
+                    continue
+                if not os.path.exists(self._master_path(image_id)):
+                    continue
+                return self._open(image_id)
+            return None
+
+    def _open(self, image_id):
+        img = Image.open(self._master_path(image_id))
+        img.info["library_id"] = image_id
+        img.info["crops"] = {size: self._crop_path(image_id, size) for size in PANEL_SIZES}
+        return img
+
+    def ingest(self, image, query, source, caption=""):
+        """
+        Stores an image fetched online (master + pre-cropped panel variants)
+        and adds its keywords to the index. Returns the library copy of the image.
+        """
+        image_id = self.source_id(source)
+        tags = sorted(set(tokenize(query)) | set(tokenize(caption)))
+
+        with self._lock:
+            if image_id not in self.images:
+                try:
+                    os.makedirs(self.root, exist_ok=True)
+                    master = image.convert("RGB")
+                    if master.width > MASTER_MAX_WIDTH:
+                        height = int(master.height * MASTER_MAX_WIDTH / master.width)
+                        master = master.resize((MASTER_MAX_WIDTH, height), Image.Resampling.LANCZOS)
+                    master.save(self._master_path(image_id), quality=90)
+                    for size in PANEL_SIZES:
+                        fit_image(master, size).save(self._crop_path(image_id, size), quality=90)
+                except Exception as e:
+                    print(f"Failed to ingest image into library: {e}")
+                    return image
+                self.images[image_id] = {"tags": [], "source": source}
+
+            # Merge new keywords so the same photo becomes findable by more queries
+            entry = self.images[image_id]
+            for tag in tags:
+                if tag not in entry["tags"]:
+                    entry["tags"].append(tag)
+                    self.postings.setdefault(tag, []).append(image_id)
+
+            try:
+                self._save()
+            except Exception as e:
+                print(f"Failed to save image library index: {e}")
+
+            return self._open(image_id)
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def get_library():
+    """
+    Returns the process-wide library instance (index loaded once).
+    """
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = ImageLibrary()
+        return _library
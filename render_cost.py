@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from slide_renderer import OUTPUT_PROFILES
+from transitions import FPS, STILL_UNIT_FRAMES, plan_segments, encoded_frame_count
+
+# Where measured narration / encode timings are kept for calibration
+CALIBRATION_PATH = os.environ.get("RENDER_CALIBRATION_PATH", "render_calibration.json")
+
+# Keep only the most recent samples so the model follows voice/engine updates
+MAX_SAMPLES = 200
+
+# Minimum number of samples before measured data replaces the defaults
+MIN_SAMPLES = 5
+
+# Edge TTS speaking rate (characters of Japanese script per second) and the
+# fixed leading/trailing silence per clip. Used until calibration data exists.
+DEFAULT_NARRATION_RATE = {
+    "ja-JP-NanamiNeural": (7.5, 0.6),
+    "ja-JP-KeitaNeural": (7.0, 0.6),
+}
+FALLBACK_NARRATION_RATE = (7.0, 0.6)
+
+# Encode cost in seconds per megapixel of *encoded* frames, per engine.
+# "compose": moviepy per-frame compositing; every output frame is encoded
+# "segments": video_gen; only transitions and one still unit per slide are
+#             encoded, the rest is stream copy (see encode_work)
+# Measured with libx264 ultrafast, threads=2, 1920x1080, 3 slides of 5-20 s:
+# compose 0.027-0.030, segments 0.014-0.018 incl. per-segment process overhead
+# (rounded up so admission errs on the safe side)
+DEFAULT_ENCODE_COST = {
+    "compose": 0.030,
+    "segments": 0.018,
+}
+
+# Rough fixed memory per encoder (ffmpeg processes + pipe buffers), MB
+ENCODER_BASE_MB = 250
+# Working copies of a frame kept per encoder while blending transitions
+ENCODER_WORKING_FRAMES = 4
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a job can never fit in the node budget, or waited too long for capacity.
+    """
+
+
+def _load_calibration():
+    if not os.path.exists(CALIBRATION_PATH):
+        return {"narration": {}, "encode": {}}
+    try:
+        with open(CALIBRATION_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        data.setdefault("narration", {})
+        data.setdefault("encode", {})
+        return data
+    except Exception as e:
+        print(f"Failed to load render calibration: {e}")
+        return {"narration": {}, "encode": {}}
+
+
+_calibration = _load_calibration()
+_calibration_lock = threading.Lock()
+
+
+def _save_calibration():
+    tmp_path = CALIBRATION_PATH + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_calibration, f)
+        os.replace(tmp_path, CALIBRATION_PATH)
+    except Exception as e:
+        print(f"Failed to save render calibration: {e}")
+
+
+def _fit_line(samples):
+    """
+    Least-squares fit of y = a*x + b over (x, y) samples.
+    Returns None when the samples cannot determine a line.
+    """
+    n = len(samples)
+    mean_x = sum(x for x, _ in samples) / n
+    mean_y = sum(y for _, y in samples) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+    if var_x == 0:
+        return None
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x
+    if slope <= 0:
+        return None
+    return slope, mean_y - slope * mean_x
+
+
+def record_narrations(measurements):
+    """
+    Records actual Edge TTS output durations for calibration, saving once per batch.
+
+    Args:
+        measurements (list): (voice, text, duration) tuples, e.g. every narration of a job
+    """
+    with _calibration_lock:
+        for voice, text, duration in measurements:
+            samples = _calibration["narration"].setdefault(voice, [])
+            samples.append([len(text), duration])
+            del samples[:-MAX_SAMPLES]
+        _save_calibration()
+
+
+def record_encode(engine, megapixel_frames, seconds):
+    """
+    Records an actual encode time (total output megapixel-frames -> seconds).
+    """
+    with _calibration_lock:
+        samples = _calibration["encode"].setdefault(engine, [])
+        samples.append([megapixel_frames, seconds])
+        del samples[:-MAX_SAMPLES]
+        _save_calibration()
+
+
+def estimate_narration_seconds(text, voice):
+    """
+    Predicts the narration length of one slide from its script length.
+    """
+    with _calibration_lock:
+        samples = list(_calibration["narration"].get(voice, []))
+
+    if len(samples) >= MIN_SAMPLES:
+        fit = _fit_line(samples)
+        if fit:
+            slope, intercept = fit
+            return max(slope * len(text) + intercept, 0.5)
+
+    chars_per_second, padding = DEFAULT_NARRATION_RATE.get(voice, FALLBACK_NARRATION_RATE)
+    return len(text) / chars_per_second + padding
+
+
+def _encode_seconds_per_megapixel_frame(engine):
+    with _calibration_lock:
+        samples = list(_calibration["encode"].get(engine, []))
+
+    if len(samples) >= MIN_SAMPLES:
+        total_work = sum(x for x, _ in samples)
+        if total_work > 0:
+            return sum(y for _, y in samples) / total_work
+    return DEFAULT_ENCODE_COST.get(engine, DEFAULT_ENCODE_COST["compose"])
+
+
+def encode_work(profile, durations, engine="segments", transition="fade"):
+    """
+    Megapixel-frames the encoder actually processes for one profile.
+    """
+    width, height = OUTPUT_PROFILES[profile]["size"]
+    if engine == "segments":
+        frames = encoded_frame_count(plan_segments(durations, kind=transition, fps=FPS), STILL_UNIT_FRAMES)
+    else:
+        frames = sum(durations) * FPS
+    return width * height / 1e6 * frames
+
+
+def estimate_job(scripts, voices, profiles, engine="segments", threads=2, durations=None, transition="fade"):
+    """
+    Predicts the cost of a Phase 3 job. Before TTS the slide durations are
+    predicted from the scripts; once narration exists, pass the measured ones.
+
+    Args:
+        scripts (list): narration script per slide
+        voices (list): voices to synthesize
+        profiles (list): output profiles to encode
+        engine (str): encode engine (see DEFAULT_ENCODE_COST)
+        threads (int): ffmpeg threads per encoder
+        durations (list): measured slide durations (s), if already known
+        transition (str): slide transition (see transitions.TRANSITIONS)
+
+    Returns:
+        dict: {
+            "duration": predicted video length (s, longest voice per slide),
+            "encode_seconds": predicted wall-clock encode time (s),
+            "peak_memory_mb": predicted peak memory (MB),
+            "cpu": CPU threads the job will keep busy
+        }
+    """
+    if durations is None:
+        durations = [
+            max(estimate_narration_seconds(script, voice) for voice in voices)
+            for script in scripts
+        ]
+    duration = sum(durations)
+
+    # Variants are encoded in parallel, so wall-clock time follows the largest one
+    per_profile = [
+        encode_work(profile, durations, engine, transition) * _encode_seconds_per_megapixel_frame(engine)
+        for profile in profiles
+    ]
+    encode_seconds = max(per_profile) if per_profile else 0.0
+
+    # In-memory RGB frames for every slide and profile, plus per-encoder working set
+    frame_mb = sum(
+        OUTPUT_PROFILES[profile]["size"][0] * OUTPUT_PROFILES[profile]["size"][1] * 3 / 1e6
+        for profile in profiles
+    )
+    peak_memory_mb = (
+        frame_mb * len(scripts)
+        + frame_mb * ENCODER_WORKING_FRAMES
+        + ENCODER_BASE_MB * len(profiles)
+    )
+
+    return {
+        "duration": duration,
+        "encode_seconds": encode_seconds,
+        "peak_memory_mb": peak_memory_mb,
+        "cpu": threads * len(profiles),
+    }
+
+
+def _default_memory_budget_mb():
+    """
+    80% of physical memory, or RENDER_MEMORY_BUDGET_MB if set.
+    """
+    if "RENDER_MEMORY_BUDGET_MB" in os.environ:
+        return float(os.environ["RENDER_MEMORY_BUDGET_MB"])
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) / 1024 * 0.8
+    except OSError:
+        pass
+    return 2048.0
+
+
+class AdmissionController:
+    """
+    Admits render jobs only while their predicted CPU and memory fit in the
+    node budget; other jobs wait in FIFO order or are rejected.
+    """
+
+    def __init__(self, cpu_budget=None, memory_budget_mb=None):
+        self.cpu_budget = cpu_budget or int(os.environ.get("RENDER_CPU_BUDGET", os.cpu_count() or 2))
+        self.memory_budget_mb = memory_budget_mb or _default_memory_budget_mb()
+        self.cpu_in_use = 0
+        self.memory_in_use_mb = 0.0
+        self._queue = []
+        self._cond = threading.Condition()
+
+    def _fits(self, cpu, memory_mb):
+        return (
+            self.cpu_in_use + cpu <= self.cpu_budget
+            and self.memory_in_use_mb + memory_mb <= self.memory_budget_mb
+        )
+
+    @contextmanager
+    def admit(self, estimate, timeout=600):
+        """
+        Blocks until the job fits, then reserves its predicted load for the
+        duration of the with-block.
+
+        Raises:
+            AdmissionRejected: the job alone exceeds the memory budget,
+                               or no capacity freed up within `timeout` seconds.
+        """
+        memory_mb = estimate["peak_memory_mb"]
+        # A job wider than the node still runs, just alone
+        cpu = min(estimate["cpu"], self.cpu_budget)
+
+        if memory_mb > self.memory_budget_mb:
+            raise AdmissionRejected(
+                f"Predicted memory {memory_mb:.0f} MB exceeds budget {self.memory_budget_mb:.0f} MB"
+            )
+
+        ticket = object()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while self._queue[0] is not ticket or not self._fits(cpu, memory_mb):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise AdmissionRejected("Timed out waiting for render capacity")
+                    self._cond.wait(remaining)
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+            self.cpu_in_use += cpu
+            self.memory_in_use_mb += memory_mb
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.cpu_in_use -= cpu
+                self.memory_in_use_mb -= memory_mb
+                self._cond.notify_all()
+
+    def queue_length(self):
+        with self._cond:
+            return len(self._queue)
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """
+    Returns the process-wide admission controller (shared by all Streamlit sessions).
+    """
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController()
+        return _controller
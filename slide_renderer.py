@@ -1,7 +1,118 @@
 from PIL import Image, ImageDraw, ImageFont, ImageEnhance
 import textwrap
 import os
+from functools import lru_cache
 
+# Output profiles (one per aspect ratio) and their layout rules.
+# "split": text panel on the left, photo on the right (landscape)
+# "stack": photo on top, text panel below (vertical / square)
+# Themes with a "split" layout use these boxes as they are.
+# Boxes are (x, y, width, height) in output pixels.
+OUTPUT_PROFILES = {
+    "16:9": {
+        "size": (1920, 1080),
+        "layout": "split",
+        "image_box": (768, 0, 1152, 1080),   # Right 60%
+        "text_box": (0, 0, 768, 1080),       # Left 40%
+        "title_size": 90,
+        "body_size": 60,
+        "title_wrap": 12,
+        "body_wrap": 18,
+        "margin_x": 80,
+        "margin_top": 150,
+    },
+    "9:16": {
+        "size": (1080, 1920),
+        "layout": "stack",
+        "image_box": (0, 0, 1080, 864),      # Top 45%
+        "text_box": (0, 864, 1080, 1056),
+        "title_size": 84,
+        "body_size": 56,
+        "title_wrap": 11,
+        "body_wrap": 16,
+        "margin_x": 80,
+        "margin_top": 100,
+    },
+    "1:1": {
+        "size": (1080, 1080),
+        "layout": "stack",
+        "image_box": (0, 0, 1080, 432),      # Top 40%
+        "text_box": (0, 432, 1080, 648),
+        "title_size": 66,
+        "body_size": 44,
+        "title_wrap": 14,
+        "body_wrap": 20,
+        "margin_x": 70,
+        "margin_top": 50,
+    },
+}
+
+DEFAULT_PROFILE = "16:9"
+
+# Themes: layout + colour palette + font scale.
+# Layouts:
+#   "split": photo and text panel side by side / stacked (the profile's image_box and text_box)
+#   "fullbleed": photo fills the canvas, text sits on a translucent panel over the text_box
+#   "title": photo fills the canvas, large title over a gradient band, no bullet points
+THEMES = {
+    "slate": {
+        "layout": "split",
+        "background": (30, 33, 40),   # Dark Slate/Charcoal
+        "title_color": "white",
+        "body_color": "#e0e0e0",
+        "accent": "#4da6ff",
+        "font_scale": 1.0,
+    },
+    "paper": {
+        "layout": "split",
+        "background": (245, 243, 238),
+        "title_color": (30, 33, 40),
+        "body_color": (70, 72, 80),
+        "accent": "#e07a2e",
+        "font_scale": 1.0,
+    },
+    "midnight": {
+        "layout": "fullbleed",
+        "background": (12, 18, 32),
+        "panel_alpha": 200,
+        "title_color": "white",
+        "body_color": "#dde6f5",
+        "accent": "#f5c542",
+        "font_scale": 0.95,
+    },
+    "cinema": {
+        "layout": "title",
+        "background": (0, 0, 0),
+        "panel_alpha": 230,
+        "title_color": "white",
+        "body_color": "white",
+        "accent": "#ff5a5f",
+        "font_scale": 1.25,
+    },
+}
+
+DEFAULT_THEME = "slate"
+
+def _layout_boxes(spec, layout):
+    """
+    (image_box, text_box) of a theme layout within an output profile.
+    """
+    width, height = spec["size"]
+    if layout == "split":
+        return spec["image_box"], spec["text_box"]
+    if layout == "fullbleed":
+        return (0, 0, width, height), spec["text_box"]
+    return (0, 0, width, height), (0, 0, width, height)
+
+# Sizes of the background panel cut out of the photo by draw_slide.
+# image_library pre-crops every stored image to these sizes.
+PANEL_SIZES = sorted({
+    _layout_boxes(spec, theme["layout"])[0][2:]
+    for spec in OUTPUT_PROFILES.values()
+    for theme in THEMES.values()
+})
+
+@lru_cache(maxsize=None)
 def load_japanese_font(size):
     """
     Tries to load a standard Japanese font available on Windows.
@@ -29,85 +140,205 @@ def load_japanese_font(size):
     # Absolute fallback to default if nothing works
     return ImageFont.load_default()
 
-def draw_slide(background_image, title, bullet_points):
+def fit_image(image, size):
     """
-    Composes the final slide image with a Split Layout.
-    Left 40%: Dark Text Area
-    Right 60%: Full Image Area
+    Resizes and center-crops an image so that it exactly fills `size`.
+    If the image carries a pre-cropped variant for this size
+    (image.info["crops"], set by image_library), that file is used instead.
     """
-    target_size = (1920, 1080)
+    img_width, img_height = size
     
-    # 1. Create Base Canvas (Dark Background for text area)
-    # Using a dark elegant color (e.g., Dark Slate/Charcoal)
-    canvas = Image.new('RGB', target_size, (30, 33, 40)) 
+    crop_path = image.info.get("crops", {}).get(size)
+    if crop_path and os.path.exists(crop_path):
+        return Image.open(crop_path).convert('RGB')
     
-    # 2. Paste the AI Generated Image on the Right side
-    # Resize image to fit height, maintain aspect ratio or crop to width
-    # Target area for image: 1152x1080 (60% width)
-    img_width = int(target_size[0] * 0.6)
-    img_height = target_size[1]
+    if image.size == size:
+        return image
     
-    # Resize/Crop background image to fill the right side
     # Calculate aspect ratios
-    bg_ratio = background_image.width / background_image.height
+    bg_ratio = image.width / image.height
     target_ratio = img_width / img_height
     
     if bg_ratio > target_ratio:
         # Image is wider, crop width
         new_height = img_height
         new_width = int(new_height * bg_ratio)
-        resized_bg = background_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        resized_bg = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
         left_crop = (new_width - img_width) // 2
-        cropped_bg = resized_bg.crop((left_crop, 0, left_crop + img_width, new_height))
+        return resized_bg.crop((left_crop, 0, left_crop + img_width, new_height))
     else:
         # Image is taller, crop height
         new_width = img_width
         new_height = int(new_width / bg_ratio)
-        resized_bg = background_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        resized_bg = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
         top_crop = (new_height - img_height) // 2
-        cropped_bg = resized_bg.crop((0, top_crop, new_width, top_crop + img_height))
+        return resized_bg.crop((0, top_crop, new_width, top_crop + img_height))
+
+@lru_cache(maxsize=None)
+def _theme_layers(theme_name, profile):
+    """
+    Renders the static layers of a theme for one output profile, once.
+    Every slide then only copies the base, pastes its photo and draws its
+    text layer (title, accent separator, bullets).
+    
+    Returns:
+        dict with the cached "base" canvas (under the photo), the RGBA "overlay"
+        panel/gradient (over the photo, or None), the layout boxes and the text metrics.
+        The cached images must not be modified.
+    """
+    theme = THEMES[theme_name]
+    spec = OUTPUT_PROFILES[profile]
+    width, height = spec["size"]
+    image_box, text_box = _layout_boxes(spec, theme["layout"])
+    
+    scale = theme["font_scale"]
+    title_size = int(spec["title_size"] * scale)
+    body_size = int(spec["body_size"] * scale)
     
-    # Paste formatted image to the right side
-    canvas.paste(cropped_bg, (target_size[0] - img_width, 0))
+    text_x, text_y, text_width, text_height = text_box
+    margin_x = text_x + spec["margin_x"]
     
-    # 3. Draw Text on the Left Side
+    # Wrap widths follow the text area width and the font scale
+    wrap_factor = text_width / spec["text_box"][2] / scale
+    
+    # 1. Base Canvas (text area colour)
+    base = Image.new('RGB', spec["size"], theme["background"])
+    overlay = None
+    
+    if theme["layout"] == "fullbleed":
+        # Translucent panel behind the text
+        overlay = Image.new('RGBA', spec["size"], (0, 0, 0, 0))
+        ImageDraw.Draw(overlay).rectangle(
+            [text_x, text_y, text_x + text_width, text_y + text_height],
+            fill=theme["background"] + (theme["panel_alpha"],)
+        )
+    elif theme["layout"] == "title":
+        # Gradient band at the bottom, fading in from transparent
+        band_height = int(height * 0.45)
+        band = Image.new('RGBA', (width, band_height), theme["background"] + (0,))
+        alpha = Image.linear_gradient('L').resize((width, band_height))
+        band.putalpha(alpha.point(lambda v: v * theme["panel_alpha"] // 255))
+        overlay = Image.new('RGBA', spec["size"], (0, 0, 0, 0))
+        overlay.paste(band, (0, height - band_height))
+    
+    return {
+        "base": base,
+        "overlay": overlay,
+        "image_box": image_box,
+        "margin_x": margin_x,
+        "text_top": text_y + spec["margin_top"],
+        "text_right": text_x + text_width - 50,
+        # "title" layout: title sits at the bottom, above the accent bar
+        "title_bottom": height - spec["margin_top"] if theme["layout"] == "title" else None,
+        "title_size": title_size,
+        "body_size": body_size,
+        "title_wrap": max(int(spec["title_wrap"] * wrap_factor), 1),
+        "body_wrap": max(int(spec["body_wrap"] * wrap_factor), 1),
+        "show_bullets": theme["layout"] != "title",
+    }
+
+def _fit_bottom_title(title, layers):
+    """
+    Wraps a bottom-anchored title, shrinking the font until every line fits
+    between the top margin and the accent bar (down to half size).
+    
+    Returns:
+        (lines, font_size)
+    """
+    size = layers["title_size"]
+    available = layers["title_bottom"] - 30 - layers["text_top"]
+    while True:
+        wrap = max(int(layers["title_wrap"] * layers["title_size"] / size), 1)
+        lines = textwrap.wrap(title, width=wrap)
+        if len(lines) * size <= available or size <= layers["title_size"] // 2:
+            return lines, size
+        size = int(size * 0.9)
+
+def draw_slide(background_image, title, bullet_points, profile=DEFAULT_PROFILE, theme=DEFAULT_THEME):
+    """
+    Composes the final slide image for one output profile (see OUTPUT_PROFILES)
+    in the given theme (see THEMES). The default "slate" theme in 16:9 is the
+    Split Layout:
+    Left 40%: Dark Text Area
+    Right 60%: Full Image Area
+    """
+    layers = _theme_layers(theme, profile)
+    colors = THEMES[theme]
+    
+    # 1. Start from a copy of the cached static base
+    canvas = layers["base"].copy()
+    
+    # 2. Paste the background photo into the image box
+    # Resize image to fill the box, cropping the overflow
+    img_x, img_y, img_width, img_height = layers["image_box"]
+    cropped_bg = fit_image(background_image, (img_width, img_height))
+    canvas.paste(cropped_bg, (img_x, img_y))
+    
+    # Static layers that sit over the photo (panels, gradients)
+    if layers["overlay"] is not None:
+        canvas.paste(layers["overlay"], (0, 0), layers["overlay"])
+    
+    # 3. Draw Text
     draw = ImageDraw.Draw(canvas)
     
-    # Fonts
-    # Fonts
-    # Adjusted sizes for better visibility
-    title_font = load_japanese_font(90)  # Was 70
-    body_font = load_japanese_font(60)   # Was 45
+    # Fonts (cached per size, shared by all slides and profiles)
+    body_font = load_japanese_font(layers["body_size"])
     
-    # Margins for text area
-    text_area_width = target_size[0] - img_width
-    margin_x = 80
-    current_y = 150
+    margin_x = layers["margin_x"]
     
     # Draw Title
     # Wrap title if needed
-    title_lines = textwrap.wrap(title, width=12) # narrower for left column
+    if layers["title_bottom"] is None:
+        # Top-anchored; the separator follows the wrapped title
+        title_size = layers["title_size"]
+        title_lines = textwrap.wrap(title, width=layers["title_wrap"])
+        current_y = layers["text_top"]
+    else:
+        # Bottom-anchored above the accent bar
+        title_lines, title_size = _fit_bottom_title(title, layers)
+        current_y = layers["title_bottom"] - 30 - len(title_lines) * title_size
+    
+    title_font = load_japanese_font(title_size)
     for line in title_lines:
-        draw.text((margin_x, current_y), line, font=title_font, fill="white")
-        current_y += 90
+        draw.text((margin_x, current_y), line, font=title_font, fill=colors["title_color"])
+        current_y += title_size
         
     # Draw Separator
     current_y += 30
-    draw.line([(margin_x, current_y), (text_area_width - 50, current_y)], fill="#4da6ff", width=4) # Accent color
+    draw.line([(margin_x, current_y), (layers["text_right"], current_y)], fill=colors["accent"], width=4) # Accent color
     current_y += 60
     
+    if not layers["show_bullets"]:
+        return canvas
+    
     # Draw Bullet Points
-    line_spacing = 70
+    line_spacing = layers["body_size"] + 10
     
     for point in bullet_points:
         # Wrap text
-        wrapped_lines = textwrap.wrap(point, width=18)
+        wrapped_lines = textwrap.wrap(point, width=layers["body_wrap"])
         
         for i, line in enumerate(wrapped_lines):
             prefix = "• " if i == 0 else "  "
-            draw.text((margin_x, current_y), f"{prefix}{line}", font=body_font, fill="#e0e0e0")
+            draw.text((margin_x, current_y), f"{prefix}{line}", font=body_font, fill=colors["body_color"])
             current_y += line_spacing
         
         current_y += 20 # Extra space between points
             
     return canvas
+
+def draw_slide_variants(background_image, title, bullet_points, profiles=(DEFAULT_PROFILE,), theme=DEFAULT_THEME):
+    """
+    Renders the same slide for several output profiles in one pass.
+    The background is decoded once; fonts and theme layers are shared across variants.
+    
+    Returns:
+        dict: profile name -> PIL Image
+    """
+    # Force a single decode up front; every variant crops from this copy
+    background_image.load()
+    
+    return {
+        profile: draw_slide(background_image, title, bullet_points, profile=profile, theme=theme)
+        for profile in profiles
+    }
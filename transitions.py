@@ -0,0 +1,116 @@
+import numpy as np
+
+# Output frame rate (shared by video_gen and the render_cost model)
+FPS = 24
+
+# Still stretches are encoded once as a unit of this many frames and then
+# repeated by stream copy (concat demuxer), so they cost no encode time
+STILL_UNIT_FRAMES = FPS
+
+# Length of every transition in seconds
+TRANSITION_DURATION = 0.5
+
+# "fade": every slide fades in from black (the original look)
+# "crossfade": the previous slide dissolves into the next one
+# "wipe": the next slide pushes the previous one out to the left
+TRANSITIONS = ["fade", "crossfade", "wipe", "none"]
+
+
+def _ease(progress):
+    """
+    Smoothstep easing so motion starts and ends softly.
+    """
+    return progress * progress * (3 - 2 * progress)
+
+
+def blend(prev_frame, next_frame, progress):
+    """
+    Linear blend of two uint8 RGB frames, in integer math (no float copies).
+    progress: 0.0 = prev_frame, 1.0 = next_frame
+    """
+    weight = int(round(progress * 256))
+    if weight <= 0:
+        return prev_frame
+    if weight >= 256:
+        return next_frame
+    mixed = prev_frame.astype(np.uint16) * (256 - weight)
+    mixed += next_frame.astype(np.uint16) * weight
+    return (mixed >> 8).astype(np.uint8)
+
+
+def wipe(prev_frame, next_frame, progress):
+    """
+    Horizontal push: the next frame slides in from the right.
+    """
+    width = next_frame.shape[1]
+    offset = int(round(_ease(progress) * width))
+    if offset <= 0:
+        return prev_frame
+    if offset >= width:
+        return next_frame
+    out = np.empty_like(next_frame)
+    out[:, :width - offset] = prev_frame[:, offset:]
+    out[:, width - offset:] = next_frame[:, :offset]
+    return out
+
+
+def transition_frames(kind, prev_frame, next_frame, frame_count):
+    """
+    Yields the frames of one transition, one at a time, so only the frame
+    being encoded is held in memory.
+
+    Args:
+        kind (str): "fade", "crossfade" or "wipe"
+        prev_frame (ndarray): outgoing slide, or None at the start of the video
+        next_frame (ndarray): incoming slide
+        frame_count (int): transition length in frames
+    """
+    if kind == "fade" or prev_frame is None:
+        prev_frame = np.zeros_like(next_frame)
+
+    render = wipe if kind == "wipe" else blend
+    for i in range(frame_count):
+        yield render(prev_frame, next_frame, i / frame_count)
+
+
+def plan_segments(durations, kind="fade", fps=FPS, duration=TRANSITION_DURATION):
+    """
+    Splits the slideshow timeline into a transition part and a still part per slide.
+    Slide boundaries are rounded on the cumulative timeline, so the video
+    stays in sync with the concatenated narration.
+
+    Args:
+        durations (list): seconds each slide stays on screen (including its transition)
+        kind (str): one of TRANSITIONS
+        fps (int): output frame rate
+        duration (float): transition length in seconds
+
+    Returns:
+        list: (transition_frames, still_frames) per slide
+    """
+    plan = []
+    elapsed = 0.0
+    start = 0
+    for slide_duration in durations:
+        elapsed += slide_duration
+        end = int(round(elapsed * fps))
+        total = end - start
+        start = end
+
+        # Never let the transition eat more than half of a short slide
+        transition = 0 if kind == "none" else min(int(round(duration * fps)), total // 2)
+        plan.append((transition, total - transition))
+    return plan
+
+
+def encoded_frame_count(plan, unit_frames=STILL_UNIT_FRAMES):
+    """
+    Frames that actually go through the encoder for a plan: every transition
+    frame, plus one still unit and the remainder per slide. Whole units are
+    repeated by stream copy and cost nothing.
+    """
+    count = 0
+    for transition, still in plan:
+        count += transition
+        count += still if still < unit_frames else unit_frames + still % unit_frames
+    return count
@@ -1,84 +1,406 @@
-from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips, vfx
+from moviepy.editor import AudioFileClip, CompositeAudioClip, concatenate_audioclips
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
+import numpy as np
+import subprocess
+import tempfile
 import os
 
-def create_video(slides_data, output_path="output_video.mp4"):
+from transitions import FPS, STILL_UNIT_FRAMES, plan_segments, transition_frames
+
+def _frame_sources(slide):
     """
-    Creates a video from a list of slides (image + audio).
-    
+    Per-profile frame sources of a slide: in-memory frames ('frames') when
+    rendering and encoding happen in the same job, image files otherwise.
+    """
+    return slide.get('frames') or slide['image_paths']
+
+def _as_frame(source):
+    """
+    Turns a frame source into a uint8 RGB array: PIL images are copied as
+    raw pixels (no PNG encode/decode), paths are decoded once.
+    """
+    if isinstance(source, str):
+        source = Image.open(source)
+    if isinstance(source, Image.Image):
+        if source.mode != 'RGB':
+            source = source.convert('RGB')
+        # Raw pixel copy (no PNG encode/decode)
+        return np.asarray(source)
+    return source
+
+def _load_narration(slides_data):
+    """
+    Loads each slide's narration (one clip per voice) once.
+    Slides with missing assets are dropped.
+
+    Returns:
+        list of (slide, {voice: AudioFileClip}) pairs
+    """
+    loaded = []
+    for slide in slides_data:
+        image_paths = [src for src in _frame_sources(slide).values() if isinstance(src, str)]
+        audio_paths = slide['audio_paths']
+
+        paths = image_paths + list(audio_paths.values())
+        if not all(os.path.exists(p) for p in paths):
+            print(f"Missing asset for slide: {slide}")
+            continue
+
+        loaded.append((slide, {voice: AudioFileClip(path) for voice, path in audio_paths.items()}))
+    return loaded
+
+def _shared_timeline(loaded):
+    """
+    Slide durations shared by every voice: the longest narration wins.
+    """
+    return [max(clip.duration for clip in audio_clips.values()) for _, audio_clips in loaded]
+
+def _write_narration_track(audio_clips, durations, output_path):
+    """
+    Concatenates one voice's narration on the shared timeline, padding
+    slides where this voice is shorter with silence, and encodes it to AAC.
+    """
+    padded = [
+        CompositeAudioClip([clip]).set_duration(duration)
+        for clip, duration in zip(audio_clips, durations)
+    ]
+    track = concatenate_audioclips(padded)
+    try:
+        track.write_audiofile(output_path, fps=44100, codec='aac', logger=None)
+    finally:
+        track.close()
+    return output_path
+
+def _encode_frames(frames, size, output_path, threads):
+    """
+    Pipes raw RGB frames straight into ffmpeg (libx264) without any intermediate image files.
+    """
+    import imageio_ffmpeg
+
+    cmd = [
+        imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}", "-r", str(FPS),
+        "-i", "-",
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+        "-threads", str(threads),
+        output_path
+    ]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for frame in frames:
+            proc.stdin.write(memoryview(np.ascontiguousarray(frame)))
+    except BrokenPipeError:
+        # ffmpeg exited early; its stderr below carries the actual error
+        pass
+    finally:
+        _, stderr = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace')}")
+    return output_path
+
+def _write_variant(profile, frames, durations, audio_path, output_path, threads, transition="fade"):
+    """
+    Encodes one output profile's video stream. The narration is pre-encoded
+    and passed as a file (muxed without re-encoding); with audio_path=None
+    the result is video only.
+
+    Only transition frames and one short still unit per slide are encoded;
+    the rest of each still stretch repeats that unit by stream copy, so encode
+    time grows with the number of slides, not with the video length.
+    """
+    import imageio_ffmpeg
+
+    try:
+        frames = [_as_frame(frame) for frame in frames]
+        size = (frames[0].shape[1], frames[0].shape[0])
+        plan = plan_segments(durations, kind=transition, fps=FPS)
+
+        print(f"Writing {profile} video to {output_path}...")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            segments = []
+            prev_frame = None
+            for i, (frame, (transition_count, still_count)) in enumerate(zip(frames, plan)):
+                # Transition: the only frames that are actually computed
+                if transition_count:
+                    path = os.path.join(temp_dir, f"slide_{i}_transition.mp4")
+                    _encode_frames(transition_frames(transition, prev_frame, frame, transition_count), size, path, threads)
+                    segments.append(path)
+
+                # Still: one encoded unit repeated, plus the remainder
+                units, remainder = divmod(still_count, STILL_UNIT_FRAMES)
+                if units:
+                    path = os.path.join(temp_dir, f"slide_{i}_still.mp4")
+                    _encode_frames([frame] * STILL_UNIT_FRAMES, size, path, threads)
+                    segments += [path] * units
+                if remainder:
+                    path = os.path.join(temp_dir, f"slide_{i}_rest.mp4")
+                    _encode_frames([frame] * remainder, size, path, threads)
+                    segments.append(path)
+
+                prev_frame = frame
+
+            list_path = os.path.join(temp_dir, "segments.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                for path in segments:
+                    escaped = os.path.abspath(path).replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+
+            # Join the segments by stream copy and add the narration
+            cmd = [imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+                   "-f", "concat", "-safe", "0", "-i", list_path]
+            if audio_path:
+                cmd += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0"]
+            cmd += ["-c", "copy", "-movflags", "+faststart", output_path]
+            subprocess.run(cmd, check=True, capture_output=True)
+
+        return output_path
+    except subprocess.CalledProcessError as e:
+        print(f"Error creating {profile} video: {e.stderr.decode(errors='replace')}")
+        return None
+    except Exception as e:
+        print(f"Error creating {profile} video: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+# ISO 639-2 language tags for the MP4 audio tracks, by voice locale prefix
+TRACK_LANGUAGES = {
+    "ja": "jpn",
+    "en": "eng",
+}
+
+def _mux(video_path, audio_tracks, output_path):
+    """
+    Stream-copies a video stream and one or more narration tracks into an MP4.
+
+    Args:
+        video_path (str): video-only MP4
+        audio_tracks (list): (voice, audio_path) pairs; the first is the default track
+        output_path (str): destination MP4
+    """
+    import imageio_ffmpeg
+
+    cmd = [imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error", "-i", video_path]
+    for _, audio_path in audio_tracks:
+        cmd += ["-i", audio_path]
+    cmd += ["-map", "0:v:0"]
+    for i in range(len(audio_tracks)):
+        cmd += ["-map", f"{i + 1}:a:0"]
+    cmd += ["-c", "copy"]
+    for i, (voice, _) in enumerate(audio_tracks):
+        # The MP4 muxer drops "title"; players (VLC etc.) show handler_name as the track name
+        cmd += [f"-metadata:s:a:{i}", f"handler_name={voice}"]
+        language = TRACK_LANGUAGES.get(voice.split("-")[0])
+        if language:
+            cmd += [f"-metadata:s:a:{i}", f"language={language}"]
+        cmd += [f"-disposition:a:{i}", "default" if i == 0 else "0"]
+    cmd += ["-movflags", "+faststart", output_path]
+
+    subprocess.run(cmd, check=True, capture_output=True)
+    return output_path
+
+def create_video_variants(slides_data, output_paths, threads=2, transition="fade", work_dir="."):
+    """
+    Creates one video per output profile (16:9, 9:16, 1:1, ...) in a single job.
+    Narration audio and slide durations are computed once and shared;
+    the variants are encoded in parallel.
+
     Args:
         slides_data (list): List of dicts, each containing:
-            - 'image_path': path to the slide image (png/jpg)
+            - 'frames': dict of profile name -> rendered slide (PIL Image / RGB array), or
+            - 'image_paths': dict of profile name -> slide image path (png/jpg)
             - 'audio_path': path to the narration audio (mp3)
-        output_path (str): Path to save the final video.
-        
+        output_paths (dict): profile name -> path to save that variant.
+        threads (int): ffmpeg threads per variant encode.
+        transition (str): slide transition (see transitions.TRANSITIONS).
+        work_dir (str): directory for this job's temporary files
+                        (one per job, so concurrent jobs never share files).
+
     Returns:
-        str: Path to the generated video file, or None if failed.
+        dict: profile name -> generated video path, or None if that variant failed.
     """
+    results = {profile: None for profile in output_paths}
+    loaded = []
     try:
-        clips = []
-        
-        for slide in slides_data:
-            img_path = slide['image_path']
-            audio_path = slide['audio_path']
-            
-            if not os.path.exists(img_path) or not os.path.exists(audio_path):
-                print(f"Missing asset for slide: {slide}")
-                continue
-                
-            # Create Audio Clip
-            audio_clip = AudioFileClip(audio_path)
-            duration = audio_clip.duration
-            
-            # Create Image Clip with same duration
-            image_clip = ImageClip(img_path).set_duration(duration)
-            image_clip = image_clip.set_audio(audio_clip)
-            
-            # Optional: Add fadein for smooth transitions
-            image_clip = image_clip.fadein(0.5)
-            
-            clips.append(image_clip)
-            
-        if not clips:
+        loaded = _load_narration([
+            dict(slide, audio_paths={"main": slide['audio_path']})
+            for slide in slides_data
+        ])
+        if not loaded:
             print("No clips created.")
-            return None
-            
-        # Concatenate all clips
-        final_video = concatenate_videoclips(clips, method="compose")
-        
+            return results
+
+        durations = _shared_timeline(loaded)
+
         # Debug: Check ffmpeg binary
         import imageio_ffmpeg
         print(f"ffmpeg binary found at: {imageio_ffmpeg.get_ffmpeg_exe()}")
 
-        # Write to file (MP4)
-        print(f"Writing video to {output_path}...")
-        
-        # Define temp audio path to avoid permission issues
-        temp_audio = "temp_audio_for_video.m4a"
+        # Encode the narration track once for all variants
+        temp_audio = os.path.join(work_dir, "temp_audio_for_video.m4a")
         if os.path.exists(temp_audio):
             os.remove(temp_audio)
 
-        final_video.write_videofile(
-            output_path, 
-            fps=24, 
-            codec='libx264', 
-            audio_codec='aac', 
-            preset='ultrafast', 
-            threads=2,  # Reduced for cloud environment
-            logger='bar',
-            temp_audiofile=temp_audio,
-            remove_temp=True
-        )
-        
-        # Clean up clips to free memory
-        for clip in clips:
-            clip.close()
-        final_video.close()
-        
-        return output_path
-        
+        _write_narration_track([audio_clips["main"] for _, audio_clips in loaded], durations, temp_audio)
+
+        with ThreadPoolExecutor(max_workers=len(output_paths)) as pool:
+            futures = {
+                profile: pool.submit(
+                    _write_variant,
+                    profile,
+                    [_frame_sources(slide)[profile] for slide, _ in loaded],
+                    durations,
+                    temp_audio,
+                    output_path,
+                    threads,
+                    transition
+                )
+                for profile, output_path in output_paths.items()
+            }
+            for profile, future in futures.items():
+                results[profile] = future.result()
+
+        if os.path.exists(temp_audio):
+            os.remove(temp_audio)
+
+        return results
+
     except Exception as e:
         print(f"Error creating video: {e}")
         import traceback
         traceback.print_exc()
-        return None
+        return results
+    finally:
+        for _, audio_clips in loaded:
+            for clip in audio_clips.values():
+                clip.close()
+
+def create_multi_voice_videos(slides_data, output_paths, voices, mode="tracks", threads=2, transition="fade", work_dir="."):
+    """
+    Exports the same presentation narrated by several voices.
+    The video stream of each profile is encoded exactly once on a shared
+    timeline (longest narration per slide, shorter tracks padded with silence);
+    the voices are then muxed in by stream copy, so encode cost does not
+    grow with the number of voices.
+
+    Args:
+        slides_data (list): List of dicts, each containing:
+            - 'frames': dict of profile name -> rendered slide (PIL Image / RGB array), or
+            - 'image_paths': dict of profile name -> slide image path (png/jpg)
+            - 'audio_paths': dict of voice -> narration audio path (mp3)
+        output_paths (dict): profile name -> path to save that variant.
+        voices (list): voices to export, in track order.
+        mode (str): "tracks" = one MP4 per profile with one audio track per voice,
+                    "files" = one MP4 per profile and voice (<name>_<voice>.mp4).
+        threads (int): ffmpeg threads per video encode.
+        transition (str): slide transition (see transitions.TRANSITIONS).
+        work_dir (str): directory for this job's temporary files
+                        (one per job, so concurrent jobs never share files).
+
+    Returns:
+        dict: profile name -> {voice: video path}. In "tracks" mode every voice
+              maps to the same file. Failed profiles map to an empty dict.
+    """
+    results = {profile: {} for profile in output_paths}
+    loaded = []
+    temp_files = []
+    try:
+        loaded = _load_narration(slides_data)
+        if not loaded:
+            print("No clips created.")
+            return results
+
+        durations = _shared_timeline(loaded)
+
+        # Encode each voice's narration once on the shared timeline
+        narration_paths = {}
+        for voice in voices:
+            temp_audio = os.path.join(work_dir, f"temp_audio_{voice}.m4a")
+            temp_files.append(temp_audio)
+            narration_paths[voice] = temp_audio
+
+        with ThreadPoolExecutor(max_workers=len(voices) + len(output_paths)) as pool:
+            audio_futures = [
+                pool.submit(
+                    _write_narration_track,
+                    [audio_clips[voice] for _, audio_clips in loaded],
+                    durations,
+                    narration_paths[voice]
+                )
+                for voice in voices
+            ]
+
+            # Encode the video stream of each profile once, without audio
+            video_futures = {}
+            for profile in output_paths:
+                temp_video = os.path.join(work_dir, f"temp_video_{profile.replace(':', 'x')}.mp4")
+                temp_files.append(temp_video)
+                video_futures[profile] = pool.submit(
+                    _write_variant,
+                    profile,
+                    [_frame_sources(slide)[profile] for slide, _ in loaded],
+                    durations,
+                    None,
+                    temp_video,
+                    threads,
+                    transition
+                )
+
+            for future in audio_futures:
+                future.result()
+            video_paths = {profile: future.result() for profile, future in video_futures.items()}
+
+        for profile, output_path in output_paths.items():
+            video_path = video_paths[profile]
+            if not video_path:
+                continue
+            try:
+                if mode == "tracks":
+                    _mux(video_path, [(voice, narration_paths[voice]) for voice in voices], output_path)
+                    results[profile] = {voice: output_path for voice in voices}
+                else:
+                    base, ext = os.path.splitext(output_path)
+                    for voice in voices:
+                        voice_path = f"{base}_{voice}{ext}"
+                        _mux(video_path, [(voice, narration_paths[voice])], voice_path)
+                        results[profile][voice] = voice_path
+            except subprocess.CalledProcessError as e:
+                print(f"Error muxing {profile} video: {e.stderr.decode(errors='replace')}")
+
+        return results
+
+    except Exception as e:
+        print(f"Error creating multi-voice video: {e}")
+        import traceback
+        traceback.print_exc()
+        return results
+    finally:
+        for _, audio_clips in loaded:
+            for clip in audio_clips.values():
+                clip.close()
+        for path in temp_files:
+            if os.path.exists(path):
+                os.remove(path)
+
+def create_video(slides_data, output_path="output_video.mp4"):
+    """
+    Creates a video from a list of slides (image + audio).
+
+    Args:
+        slides_data (list): List of dicts, each containing:
+            - 'image' (PIL Image) or 'image_path': the slide image (png/jpg)
+            - 'audio_path': path to the narration audio (mp3)
+        output_path (str): Path to save the final video.
+
+    Returns:
+        str: Path to the generated video file, or None if failed.
+    """
+    variants_data = []
+    for slide in slides_data:
+        if 'image' in slide:
+            variants_data.append({"frames": {"main": slide['image']}, "audio_path": slide['audio_path']})
+        else:
+            variants_data.append({"image_paths": {"main": slide['image_path']}, "audio_path": slide['audio_path']})
+    return create_video_variants(variants_data, {"main": output_path})["main"]